@@ -2,12 +2,19 @@
 import os, re, json
 import pandas as pd
 from collections import Counter
-from typing import List, Dict, Any, Tuple
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    import orjson  # optional: faster JSON serialize
+except ImportError:
+    orjson = None
 
 from rule_utils import (
     squash, clean_free_text, parse_literal_set, transformation_expression,
     normalize_join, business_rules_to_where, detect_lookup, parse_set_rule,
-    _infer_datatype_from_value, _cast_to_datatype, _debug_log, _needs_cast
+    _infer_datatype_from_value, _cast_to_datatype, _debug_log, _needs_cast,
+    _NUMERIC_LIT
 )
 
 DEBUG_TRANSFORMATIONS = False
@@ -17,6 +24,10 @@ DEBUG_OUTPUT_DIR = "debug_outputs"
 # ---------- CSV loading & column mapping ----------
 
 def _rename_dupe_headers(df: pd.DataFrame) -> pd.DataFrame:
+    # read_csv already mangles duplicate headers ("X.1"), so this is normally a
+    # no-op; skip the per-column loop and df.rename's full copy in that case
+    if df.columns.is_unique:
+        return df
     rename_map, seen = {}, {}
     for col in df.columns:
         if col not in seen:
@@ -36,10 +47,29 @@ def _write_debug(name: str, content: str):
         f.write(content.strip() + "\n\n")
 
 
-def load_mapping(csv_path: str) -> pd.DataFrame:
-    df = pd.read_csv(csv_path, engine="python")
-    df = _rename_dupe_headers(df)
+# JOIN/FROM/ON text (through the end of the rule) that belongs in join_clause
+_RULE_JOIN_TAIL = re.compile(r"(?i)\b(from|join|on)\b.*", re.DOTALL)
+
+# parsed mappings keyed by (absolute path, mtime_ns); one entry per path, so an
+# edited CSV replaces its stale frame instead of accumulating
+_MAPPING_CACHE: Dict[str, Tuple[int, pd.DataFrame]] = {}
 
+def load_mapping(csv_path: str) -> pd.DataFrame:
+    """
+    Parse a mapping CSV into the canonical frame. Repeated calls for an
+    unchanged file (batch generate() runs) reuse the parsed result; callers
+    get their own copy, and the JOIN-relocation log is written on parse only.
+    """
+    key = os.path.abspath(csv_path)
+    mtime = os.stat(csv_path).st_mtime_ns
+    hit = _MAPPING_CACHE.get(key)
+    if hit is not None and hit[0] == mtime:
+        return hit[1].copy()
+    df = _parse_mapping(csv_path)
+    _MAPPING_CACHE[key] = (mtime, df)
+    return df.copy()
+
+def _parse_mapping(csv_path: str) -> pd.DataFrame:
     # Canonical header mapping
     colmap = {
         "Table/File Name * (auto populate)": "src_table",
@@ -56,48 +86,92 @@ def load_mapping(csv_path: str) -> pd.DataFrame:
         "DB Name/Outgoing File Path * (auto populate)": "tgt_path",
         "DB Name/Incoming File Path *": "src_path",
     }
+    # only parse the template columns we map (or already-canonical ones);
+    # names are matched after pandas' own ".1" de-duplication of headers
+    wanted = set(colmap) | set(colmap.values())
+    usecols = lambda c: c in wanted
+
+    # C tokenizer; every mapped column is text, so skip dtype inference
+    # (NA handling is unchanged: blank cells still become NaN, then "")
+    try:
+        df = pd.read_csv(csv_path, dtype=str, usecols=usecols)
+    except pd.errors.ParserError:
+        # the python engine tolerates some malformed exports the C one rejects
+        df = pd.read_csv(csv_path, engine="python", dtype=str, usecols=usecols)
+    df = _rename_dupe_headers(df)
+
     for k, v in colmap.items():
         if k in df.columns:
             df[v] = df[k]
 
     # 🧩 Auto-clean JOIN fragments inside transformation_rule
     if "transformation_rule" in df.columns and "join_clause" in df.columns:
-        for i, row in df.iterrows():
-            tr = str(row.get("transformation_rule", "")).strip()
-            jc = str(row.get("join_clause", "")).strip()
-
-            if re.search(r"(?i)\b(join|from|on)\b", tr):
-                join_part_match = re.search(r"(?i)\b(from|join|on)\b.*", tr, re.DOTALL)
-                if join_part_match:
-                    join_part = join_part_match.group(0)
-                    new_jc = jc + " " + join_part if jc else join_part
-                    df.at[i, "join_clause"] = new_jc.strip()
-                    tr_clean = re.sub(r"(?i)\b(from|join|on)\b.*", "", tr, flags=re.DOTALL).strip()
-                    df.at[i, "transformation_rule"] = tr_clean
-                    _write_debug(
-                        "auto_join_cleanup.log",
-                        f"Moved JOIN/FROM from transformation_rule[{i}] to join_clause:\n"
-                        f"  OLD: {tr}\n  NEW join_clause: {new_jc}\n"
-                    )
+        # Walk the two columns directly (no per-row Series boxing); only rows
+        # that actually carry a JOIN/FROM/ON tail are written back.
+        moved_logs = []
+        rows = zip(df.index, df["transformation_rule"].tolist(), df["join_clause"].tolist())
+        for i, tr_val, jc_val in rows:
+            tr = str(tr_val).strip()
+            join_part_match = _RULE_JOIN_TAIL.search(tr)
+            if join_part_match:
+                jc = str(jc_val).strip()
+                join_part = join_part_match.group(0)
+                new_jc = jc + " " + join_part if jc else join_part
+                df.at[i, "join_clause"] = new_jc.strip()
+                # the match runs to the end of the text; keep what precedes it
+                tr_clean = tr[:join_part_match.start()].strip()
+                df.at[i, "transformation_rule"] = tr_clean
+                moved_logs.append(
+                    f"Moved JOIN/FROM from transformation_rule[{i}] to join_clause:\n"
+                    f"  OLD: {tr}\n  NEW join_clause: {new_jc}"
+                )
+        # one append to the log file instead of an open/close per moved row
+        if moved_logs:
+            _write_debug("auto_join_cleanup.log", "\n\n".join(moved_logs))
 
     return df.fillna("")
 
 
 # ---------- Helpers ----------
 
+def _stripped_values(df: pd.DataFrame, col: str) -> List[str]:
+    """str()+strip() a column with pandas' string kernels, dropping empty cells."""
+    if col not in df.columns:
+        return []
+    s = df[col].astype(str).str.strip()
+    return s[s != ""].tolist()
+
 def infer_sources(df: pd.DataFrame) -> List[str]:
-    return sorted(set([str(s).strip() for s in df.get("src_table", pd.Series()) if str(s).strip()]))
+    return sorted(set(_stripped_values(df, "src_table")))
 
 def infer_target(df: pd.DataFrame) -> str:
-    vals = [str(t).strip() for t in df.get("tgt_table", pd.Series()) if str(t).strip()]
-    return Counter(vals).most_common(1)[0][0] if vals else "target_table"
+    counts = Counter(_stripped_values(df, "tgt_table"))
+    # max() keeps most_common()'s tie-break (first value seen wins)
+    return max(counts.items(), key=lambda kv: kv[1])[0] if counts else "target_table"
 
 def choose_primary(df: pd.DataFrame) -> str:
-    counts = Counter([str(r) for r in df.get("src_table", pd.Series()) if r])
-    return counts.most_common(1)[0][0] if counts else "source_table mas"
+    if "src_table" not in df.columns:
+        return "source_table mas"
+    # raw (unstripped) values; empty cells are skipped via their truthiness
+    col = df["src_table"]
+    counts = Counter(col[col.astype(bool)].astype(str).tolist())
+    return max(counts.items(), key=lambda kv: kv[1])[0] if counts else "source_table mas"
 
 # ---------- CTE Builders ----------
 
+# step1 join handling patterns (compiled once; used per join / per rule row)
+_JOIN_CANDIDATE = re.compile(r"(?i)(LEFT\s+JOIN\s+[A-Za-z0-9_\.]+\s+ON\s+[A-Za-z0-9_\.=\s\(\)']+)")
+_MAS_PREFIX_CS = re.compile(r"(?<![A-Za-z0-9_])mas\.")
+_JOIN_FROM_TAIL = re.compile(r"\s+FROM\s+[A-Za-z0-9_\. ]+(?=(\s+(LEFT|INNER|RIGHT|FULL)\s+JOIN\b|\s*$))", re.I)
+_TRAILING_SEMI = re.compile(r"\s*;\s*$")
+
+def _alias_leak_pattern(aliases: List[str]) -> Optional[re.Pattern]:
+    """One case-insensitive `<alias>.` matcher for all aliases, tried in the given order."""
+    if not aliases:
+        return None
+    alts = "|".join(re.escape(a) for a in aliases)
+    return re.compile(rf"(?<![\w])(?:{alts})\.", re.I)
+
 def _sanitize_alias_leaks(join_sql: str, base_alias: str, known_aliases: List[str]) -> str:
     """
     Dynamically replace any leaked table aliases (from CSV joins or transformations)
@@ -105,12 +179,11 @@ def _sanitize_alias_leaks(join_sql: str, base_alias: str, known_aliases: List[st
     """
     if not join_sql:
         return join_sql
-    out = join_sql
-    for alias in known_aliases:
-        pattern = rf"(?<![\w]){re.escape(alias)}\."
-        out = re.sub(pattern, f"{base_alias}.", out, flags=re.I)
-    return out
+    leak_rx = _alias_leak_pattern(known_aliases)
+    return leak_rx.sub(f"{base_alias}.", join_sql) if leak_rx else join_sql
+
 
+_ALIAS_UNSAFE = re.compile(r"[^A-Za-z0-9_]")
 
 def build_cte_sources(sources: List[str]) -> Tuple[List[str], List[str]]:
     ctes, seen_aliases, aliases_out = [], set(), []
@@ -120,8 +193,8 @@ def build_cte_sources(sources: List[str]) -> Tuple[List[str], List[str]]:
             table, alias = parts[0], parts[-1]
         else:
             table = s
-            alias = s.split("_")[0] if "_" in s else "src"
-        base = re.sub(r"[^A-Za-z0-9_]", "", alias) or "src"
+            alias = s.partition("_")[0] if "_" in s else "src"
+        base = _ALIAS_UNSAFE.sub("", alias) or "src"
         alias_u = base
         i = 1
         while alias_u in seen_aliases:
@@ -133,6 +206,14 @@ def build_cte_sources(sources: List[str]) -> Tuple[List[str], List[str]]:
     return ctes, aliases_out
 
 
+def _distinct_values(df: pd.DataFrame, col: str) -> List[Any]:
+    """Distinct cell values of a column in first-seen row order ([] if absent)."""
+    if col not in df.columns:
+        return []
+    # Series.unique() hashes in C and keeps order of appearance
+    return df[col].unique().tolist()
+
+
 def build_step1_cte(df: pd.DataFrame, primary_src: str) -> str:
     """
     Builds base CTE with deduped JOINs + business rules.
@@ -142,115 +223,95 @@ def build_step1_cte(df: pd.DataFrame, primary_src: str) -> str:
     base_alias = (primary_src.split()[-1] if " " in primary_src
                   else (primary_src.split("_")[0] if "_" in primary_src else "mas"))
 
+    # Mapping sheets repeat the same rule/join text on every column row; each
+    # loop below only ever keeps the first occurrence of a given text, so the
+    # distinct raw values (in row order) give the same result.
+
     # ----- JOIN normalization -----
     normalized_joins, seen_joins = [], set()
 
     # 🧩 Capture misplaced JOINs (but skip FROM)
-    extra_joins = []
-    for txt in df.get("transformation_rule", pd.Series()).tolist():
+    # Their keys are reserved in seen_joins in this single pass, so identical
+    # join_clause entries below are treated as already present.
+    for txt in _distinct_values(df, "transformation_rule"):
         if not isinstance(txt, str):
             continue
         # Capture only clean single JOINs (avoid multi-line FROM merges)
-        join_candidates = re.findall(
-            r"(?i)(LEFT\s+JOIN\s+[A-Za-z0-9_\.]+\s+ON\s+[A-Za-z0-9_\.=\s\(\)']+)",
-            txt
-        )
+        join_candidates = _JOIN_CANDIDATE.findall(txt)
         for jc in join_candidates:
             if "FROM " not in jc.upper() and jc.strip().upper().startswith("LEFT JOIN"):
                 cleaned = normalize_join(jc)
-                if cleaned and cleaned.lower().strip() not in seen_joins:
-                    extra_joins.append(cleaned)
-                    seen_joins.add(cleaned.lower().strip())
+                if cleaned:
+                    seen_joins.add(cleaned.lower())
 
-    # Merge extracted joins first
-    for j in extra_joins:
-        if j and j.lower().strip() not in seen_joins:
-            normalized_joins.append(j)
-            seen_joins.add(j.lower().strip())
+    # ---- Dynamically detect all aliases from join clauses for cleanup ----
+    join_vals = _distinct_values(df, "join_clause")
+    known_aliases = sorted({
+        parts[-1]
+        for parts in (x.split() for x in join_vals if isinstance(x, str))
+        if len(parts) > 1
+    })
 
-    # Then handle normal join_clause values
-    for txt in df.get("join_clause", pd.Series()).tolist():
+    # ---- join_clause values: normalize, scrub and dedupe in one pass ----
+    # Two keys per join: the raw normalized form (checked against the
+    # relocated JOINs above) and the canonical form after alias & spacing
+    # scrubbing (case-insensitive, so it subsumes a case/space-only dedupe).
+    # normalize_join() output is already squashed, so .lower() is the key.
+    # one alternation covers every leaked alias plus the mas/ossbr_2_1 defaults,
+    # so each join is scanned once instead of once per alias
+    base_prefix = f"{base_alias}."
+    leak_rx = _alias_leak_pattern(known_aliases + ["mas", "ossbr_2_1"])
+    seen = set()
+    for txt in join_vals:
         j = normalize_join(txt)
         if not j:
             continue
         # fix alias leaks before dedupe
-        j = re.sub(r"(?<![A-Za-z0-9_])mas\.", f"{base_alias}.", j)
-        key = j.lower().strip()
-        if key and key not in seen_joins:
-            normalized_joins.append(j)
-            seen_joins.add(key)
-    
-        # ---- Final join scrubbing (defensive) ---------------------------------
-    pruned = []
-    seen_join_keys = set()
-    for j in normalized_joins:
-        if not j or str(j).strip().lower() == "nan":
+        j = _MAS_PREFIX_CS.sub(f"{base_alias}.", j)
+        key = j.lower()
+        if key in seen_joins:
+            continue
+        seen_joins.add(key)
+        if key == "nan":
             continue
-        # Drop any trailing FROM... that may have survived
-        j2 = re.sub(r"\s+FROM\s+[A-Za-z0-9_\. ]+(?=(\s+(LEFT|INNER|RIGHT|FULL)\s+JOIN\b|\s*$))", "", j, flags=re.I)
-        j2 = re.sub(r"\s*;\s*$", "", j2).strip()
-
-        # Canonical key for dedupe (case/space-insensitive)
-        key = re.sub(r"\s+", " ", j2).strip().lower()
-        if key and key not in seen_join_keys:
-            pruned.append(j2)
-            seen_join_keys.add(key)
-
-    normalized_joins = pruned
 
-        # ---- Dynamically detect all aliases from join clauses for cleanup ----
-    known_aliases = sorted({
-        str(x).split()[-1]
-        for x in df.get("join_clause", [])
-        if isinstance(x, str) and len(str(x).split()) > 1
-    })
+        # Drop any trailing FROM... that may have survived
+        j = _JOIN_FROM_TAIL.sub("", j)
+        j = _TRAILING_SEMI.sub("", j)
 
-    # ---- Robust deduplication (dynamic alias & spacing normalization) ----
-    unique = []
-    seen = set()
-    for j in normalized_joins:
+        # Normalize whitespace
+        j = " ".join(j.split())
         if not j:
             continue
 
-        # Normalize whitespace
-        j = re.sub(r"\s+", " ", j).strip()
-
         # Replace any leaked aliases dynamically
-        for alias in known_aliases:
-            j = re.sub(rf"(?<![\w]){re.escape(alias)}\.", f"{base_alias}.", j, flags=re.I)
-        j = re.sub(r"(?<![\w])mas\.", f"{base_alias}.", j, flags=re.I)
-        j = re.sub(r"(?<![\w])ossbr_2_1\.", f"{base_alias}.", j, flags=re.I)
+        j = leak_rx.sub(base_prefix, j)
 
         # Normalize ON clause spacing
         j = j.replace(" =", "=").replace("= ", "=")
 
         # Canonical dedupe key
-        key = j.lower().strip()
+        key = j.lower()
         if key not in seen:
             seen.add(key)
-            unique.append(j)
-
-    normalized_joins = unique
+            normalized_joins.append(j)
 
-    joins = [f"  {j}" for j in normalized_joins]
-    join_clause = "\n".join(joins)
+    join_clause = "\n".join(f"  {j}" for j in normalized_joins)
 
-    if DEBUG_JOINS and joins:
-        _write_debug("joins_debug.log", "==== Deduped/Normalized JOINS ====\n" + "\n".join(joins))
+    if DEBUG_JOINS and join_clause:
+        _write_debug("joins_debug.log", "==== Deduped/Normalized JOINS ====\n" + join_clause)
 
     # ----- Business rules normalization -----
-    br_blocks_raw = [business_rules_to_where(txt) for txt in df.get("business_rule", pd.Series()).tolist()]
-
-    # Deduplicate identical blocks (case-insensitive)
+    # Deduplicate identical blocks (case-insensitive) and number them as they are built
     seen_rules = set()
-    br_blocks = []
-    for blk in br_blocks_raw:
-        key = blk.lower().strip()
+    where_lines = []
+    for txt in _distinct_values(df, "business_rule"):
+        blk = business_rules_to_where(txt)
+        key = blk.lower()
         if key and key not in seen_rules:
-            br_blocks.append(blk)
             seen_rules.add(key)
+            where_lines.append(f"-- Business Rule Block #{len(where_lines) + 1}\n  {blk}")
 
-    where_lines = [f"-- Business Rule Block #{i+1}\n  {blk}" for i, blk in enumerate(br_blocks) if blk]
     where_clause = "\nWHERE\n  " + "\n  AND ".join(where_lines) if where_lines else ""
 
     return (
@@ -261,31 +322,83 @@ def build_step1_cte(df: pd.DataFrame, primary_src: str) -> str:
         f"{where_clause}\n)"
     )
 
+_NON_WORD = re.compile(r"\W")
+
 def _sanitize_target_alias(tgt: str) -> str:
-    return re.sub(r"[^\w]", "_", tgt)
+    return _NON_WORD.sub("_", tgt)
 
 
+_TRAILING_PAREN_NOTE = re.compile(r"\s*\([^)]*\)\.?\s*$")
+
 def _strip_trailing_notes(lit: str) -> str:
-    return re.sub(r"\s*\([^)]*\)\.?\s*$", "", lit or "").strip()
+    return _TRAILING_PAREN_NOTE.sub("", lit or "").strip()
 
 # ---------- Final SELECT builder ----------
 
-def build_final_select(df: pd.DataFrame) -> Tuple[str, List[Dict[str, str]]]:
-    lines, audit_rows = [], []
-    grouped = df.groupby(df["tgt_column"].str.lower(), dropna=False)
+# first FROM or <type> JOIN that leaked into a column expression
+_EXPR_TAIL = re.compile(r"(?i)\s+\bfrom\b|\s+(?:left|inner|right|full)\s+join\b")
+_TRAILING_SEMIS = re.compile(r";+$")
+_LEFT_AS = re.compile(r"\bLEFT\s+AS\b", re.I)
+_LEFT_JOIN_WORDS = re.compile(r"\bLEFT\s+JOIN\b", re.I)
+_ENDS_WITH_AS_ALIAS = re.compile(r"(?i)\bas\s+\w+\b\s*$")
 
-    for tgt_lower, group in grouped:
-        tgt = group["tgt_column"].iloc[0]
-        tgt_dtype = (group["tgt_datatype"].iloc[0] if "tgt_datatype" in group else "").strip()
+@lru_cache(maxsize=4096)
+def _scrub_expr(expr: str, tgt_dtype: str) -> str:
+    """
+    Clean one SELECT expression: cut leaked FROM/JOIN text, cast bare
+    literals/NULL to the target type, drop stray semicolons and LEFT tokens.
+    Memoized: literal expressions ('A', 0, NULL, ...) repeat across columns.
+    """
+    # ---- Never allow FROM/JOIN text inside a column expression -----------
+    # If a free-form rule slipped JOIN/FROM into expr, cut it off at the source.
+    # One scan cuts at whichever comes first.
+    m = _EXPR_TAIL.search(expr)
+    if m:
+        expr = expr[:m.start()]
+    expr = expr.strip()
+
+    # expr is already stripped above; numeric literals and NULL get the same cast
+    if tgt_dtype and (_NUMERIC_LIT.fullmatch(expr.strip("'")) or expr.upper() == "NULL"):
+        inferred = _infer_datatype_from_value(expr, tgt_dtype)
+        expr = _cast_to_datatype(expr, inferred)
+
+    expr = _TRAILING_SEMIS.sub("", expr).strip()
+
+    # Remove stray LEFT JOIN tokens that accidentally merged into expressions
+    expr = _LEFT_AS.sub("AS", expr)
+    expr = _LEFT_JOIN_WORDS.sub("", expr)
+    return expr
 
-        unique_rules = list({(r or "").strip() for r in group.get("transformation_rule", []) if str(r).strip()})
-        unique_sources = list({(s or "").strip() for s in group.get("src_column", []) if str(s).strip()})
+def build_final_select(df: pd.DataFrame) -> Tuple[str, List[Dict[str, str]]]:
+    lines, audit_rows = [], []
+    # one pass buckets row positions by lower-cased target (same groups, in the
+    # same sorted order, as groupby(str.lower, dropna=False) without building
+    # a sub-frame per target); non-string targets form the trailing NaN group
+    tgts = df["tgt_column"].tolist()
+    dtypes = df["tgt_datatype"].tolist() if "tgt_datatype" in df.columns else None
+    rules = df["transformation_rule"].tolist() if "transformation_rule" in df.columns else []
+    srcs = df["src_column"].tolist() if "src_column" in df.columns else []
+    index = df.index.tolist()
+    buckets: Dict[Optional[str], List[int]] = {}
+    for pos, t in enumerate(tgts):
+        buckets.setdefault(t.lower() if isinstance(t, str) else None, []).append(pos)
+    keys = sorted(k for k in buckets if k is not None)
+    if None in buckets:
+        keys.append(None)
+
+    for key in keys:
+        rows = buckets[key]
+        tgt = tgts[rows[0]]
+        tgt_dtype = (dtypes[rows[0]] if dtypes is not None else "").strip()
+
+        unique_rules = list({(r or "").strip() for r in (rules[p] for p in rows) if str(r).strip()}) if rules else []
+        unique_sources = list({(s or "").strip() for s in (srcs[p] for p in rows) if str(s).strip()}) if srcs else []
         merged_note = ""
 
         if len(unique_rules) > 1:
             merged_note = f"-- NOTE: merged {len(unique_rules)} variations for target column '{tgt}'"
-        elif len(group) > 1:
-            merged_note = f"-- NOTE: merged {len(group)} duplicate definitions for target column '{tgt}'"
+        elif len(rows) > 1:
+            merged_note = f"-- NOTE: merged {len(rows)} duplicate definitions for target column '{tgt}'"
 
         raw_trans = unique_rules[0] if unique_rules else ""
         src_col = unique_sources[0] if unique_sources else ""
@@ -294,28 +407,9 @@ def build_final_select(df: pd.DataFrame) -> Tuple[str, List[Dict[str, str]]]:
             raw_trans, target_col=tgt, src_col=src_col, target_datatype=tgt_dtype
         )
 
-        # ---- Never allow FROM/JOIN text inside a column expression -----------
-        # If a free-form rule slipped JOIN/FROM into expr, cut it off at the source.
-        expr = re.split(r"(?i)\s+\bfrom\b", expr)[0]
-        expr = re.split(r"(?i)\s+(left|inner|right|full)\s+join\b", expr)[0]
-        expr = expr.strip()
-
-
-        if tgt_dtype and re.fullmatch(r"[-+]?\d+(\.\d+)?", expr.strip().strip("'")):
-            inferred = _infer_datatype_from_value(expr, tgt_dtype)
-            expr = _cast_to_datatype(expr, inferred)
-        elif tgt_dtype and expr.strip().upper() == "NULL":
-            inferred = _infer_datatype_from_value(expr, tgt_dtype)
-            expr = _cast_to_datatype(expr, inferred)
-
-        expr = re.sub(r";+$", "", expr).strip()
+        expr = _scrub_expr(expr, tgt_dtype)
 
-        # Remove stray LEFT JOIN tokens that accidentally merged into expressions
-        expr = re.sub(r"\bLEFT\s+AS\b", "AS", expr, flags=re.I)
-        expr = re.sub(r"\bLEFT\s+JOIN\b", "", expr, flags=re.I)
-
-
-        if not re.search(r"(?i)\bas\s+\w+\b\s*$", expr.strip()):
+        if not _ENDS_WITH_AS_ALIAS.search(expr.strip()):
             select_line = f"    {expr} AS {_sanitize_target_alias(tgt)}"
         else:
             select_line = f"    {expr}"
@@ -327,7 +421,7 @@ def build_final_select(df: pd.DataFrame) -> Tuple[str, List[Dict[str, str]]]:
 
         lines.append(select_line)
         audit_rows.append({
-            "row": f"{group.index.min() + 1}",
+            "row": f"{min(index[p] for p in rows) + 1}",
             "target": tgt,
             "raw": raw_trans.replace("\n", " ").strip(),
             "sql": expr.strip(),
@@ -339,6 +433,13 @@ def build_final_select(df: pd.DataFrame) -> Tuple[str, List[Dict[str, str]]]:
 
 # ---------- Pipeline builder ----------
 
+# post-assembly SQL auto-fixes, applied in this order; each pattern folds two
+# fix-ups whose matches can't interact, so the text is scanned 3 times, not 6
+_TYPO_OR_DOUBLE_AS = re.compile(r"\bAS\s+[A-Za-z0-9_\.]+\s+AS\s+|\b(FLAOT)\b", re.I)
+_LEFT_JOIN_BREAK = re.compile(r"(,)\s*LEFT\s+JOIN|\s+LEFT\s+JOIN")
+_COMMENT_BEFORE_ELSE_END = re.compile(r"--[^\n]*\n\s*(ELSE|END)")
+_WS_LEFT_AS = re.compile(r"\s+LEFT\s+AS\s+", re.I)
+
 def build_sql_cte_pipeline(df: pd.DataFrame, target_table: str) -> Tuple[str, List[Dict[str, str]]]:
     sources = infer_sources(df)
     cte_sources, _aliases = build_cte_sources(sources)
@@ -348,24 +449,22 @@ def build_sql_cte_pipeline(df: pd.DataFrame, target_table: str) -> Tuple[str, Li
 
     sql_text = "WITH\n" + ",\n".join(cte_sources + [step1]) + "\n" + final_select + ";\n"
     # 🧹 Auto-fix minor SQL issues
-    sql_text = re.sub(r"\bFLAOT\b", "FLOAT", sql_text, flags=re.I)
-    sql_text = re.sub(r"\bAS\s+[A-Za-z0-9_\.]+\s+AS\s+", "AS ", sql_text, flags=re.I)
-    sql_text = re.sub(r"\s+LEFT\s+JOIN", "\n  LEFT JOIN", sql_text)
-    sql_text = re.sub(r",\s*LEFT\s+JOIN", ",\n  LEFT JOIN", sql_text)
+    sql_text = _TYPO_OR_DOUBLE_AS.sub(lambda m: "FLOAT" if m.group(1) else "AS ", sql_text)
+    sql_text = _LEFT_JOIN_BREAK.sub(r"\1\n  LEFT JOIN", sql_text)
     # Remove mid-CASE comments that break ELSE/END
-    sql_text = re.sub(r"(--[^\n]*)\n\s*ELSE", r"\nELSE", sql_text)
-    sql_text = re.sub(r"(--[^\n]*)\n\s*END", r"\nEND", sql_text)
+    sql_text = _COMMENT_BEFORE_ELSE_END.sub(r"\n\1", sql_text)
     sql_text = sql_text.replace("  ", " ")
 
         # Fix dangling 'LEFT AS' tokens and duplicate ref joins
-    sql_text = re.sub(r"\s+LEFT\s+AS\s+", " AS ", sql_text, flags=re.I)
+    sql_text = _WS_LEFT_AS.sub(" AS ", sql_text)
 
     # Remove duplicate identical LEFT JOIN lines (same table & condition)
     deduped_lines = []
     seen_joins = set()
     for line in sql_text.splitlines():
-        if line.strip().upper().startswith("LEFT JOIN"):
-            norm = re.sub(r"\s+", " ", line.strip().lower())
+        # only the 9-char prefix needs upper-casing, not the whole line
+        if line.lstrip()[:9].upper() == "LEFT JOIN":
+            norm = " ".join(line.lower().split())
             if norm not in seen_joins:
                 seen_joins.add(norm)
                 deduped_lines.append(line)
@@ -431,16 +530,33 @@ def build_job_json(source_malcode: str, target_table: str, sql_path: str, df: pd
 
 # ---------- Audit markdown ----------
 
+def _md_cell(text: str) -> str:
+    """Escape a value for a markdown table cell (newlines -> <br>, pipes escaped)."""
+    return (text or "").replace("\n", "<br>").replace("|", "\\|")
+
 def write_audit_md(audit_rows: List[Dict[str, str]], md_path: str):
+    buf = [
+        "# Transformation Rules Audit\n\n",
+        "| Row | Target Column | Raw Transformation (verbatim) | Parsed SQL Expression | Notes |\n",
+        "|---:|---|---|---|---|\n",
+    ]
+    for r in audit_rows:
+        raw = _md_cell(r["raw"])
+        sql = _md_cell(r["sql"])
+        note = _md_cell(r["note"])
+        buf.append(f"| {r['row']} | `{r['target']}` | {raw} | `{sql}` | {note} |\n")
     with open(md_path, "w", encoding="utf-8") as f:
-        f.write("# Transformation Rules Audit\n\n")
-        f.write("| Row | Target Column | Raw Transformation (verbatim) | Parsed SQL Expression | Notes |\n")
-        f.write("|---:|---|---|---|---|\n")
-        for r in audit_rows:
-            raw = (r["raw"] or "").replace("\n", "<br>").replace("|", "\\|")
-            sql = (r["sql"] or "").replace("\n", "<br>").replace("|", "\\|")
-            note = (r["note"] or "").replace("\n", "<br>").replace("|", "\\|")
-            f.write(f"| {r['row']} | `{r['target']}` | {raw} | `{sql}` | {note} |\n")
+        f.writelines(buf)
+
+# ---------- JSON output ----------
+
+def _write_json(path: str, obj: Dict[str, Any]) -> None:
+    if orjson:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, indent=2, ensure_ascii=False)
 
 # ---------- Orchestration ----------
 
@@ -458,8 +574,7 @@ def generate(csv_path: str, outdir: str, source_malcode: str = "ND") -> Dict[str
 
     job_json = build_job_json(source_malcode, target, sql_path, df)
     json_path = os.path.join(job_dir, f"ew_123_{target.lower()}_{source_malcode.lower()}.json")
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(job_json, f, indent=2)
+    _write_json(json_path, job_json)
 
     md_path = os.path.join(job_dir, f"transformation_{target.lower()}_{source_malcode.lower()}_rules_audit.md")
     write_audit_md(audit_rows, md_path)
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 import argparse, json, re
+from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterator, List, Any, Optional, Set
 import pandas as pd
 
+try:
+    import orjson  # optional: faster JSON parse/serialize
+except ImportError:
+    orjson = None
+
 # ---------------- Canonical header mapping ----------------
 CANON_MAP = {
     r"(?i)^source schema id.*$": "src_row_id",
@@ -30,6 +36,10 @@ FROM_RX      = re.compile(r"(?is)\bfrom\s+([A-Za-z0-9_\.]+)\s+([A-Za-z][A-Za-z0-
 JOIN_ANY_RX  = re.compile(r"(?is)\bjoin\s+([A-Za-z0-9_\.]+)\s+([A-Za-z][A-Za-z0-9_]*)\b")
 QUAL_ID_RX   = re.compile(r"\b([A-Za-z][A-Za-z0-9_]*)\.([A-Za-z][A-Za-z0-9_]*)\b")
 AS_ALIAS_RX  = re.compile(r"(?i)\bas\s+([A-Za-z_][A-Za-z0-9_]*)\b")
+IDENT_RX     = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+# FROM_RX | JOIN_ANY_RX in one scan; the lookahead keeps overlapping hits so
+# each keyword's matches can be replayed exactly as its own finditer would.
+FROM_JOIN_RX = re.compile(r"(?is)(?=\b(from|join)\s+([A-Za-z0-9_\.]+)\s+([A-Za-z][A-Za-z0-9_]*)\b)")
 
 def s(x) -> str:
     if x is None: return ""
@@ -81,21 +91,39 @@ def load_csv(path: str) -> pd.DataFrame:
         df[c] = df[c].apply(lambda z: str(z).strip().lower() if str(z).strip() else "")
     return df
 
+# ---------------- JSON I/O ----------------
+def read_json(path: str) -> Any:
+    data = Path(path).read_bytes()
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def write_json(path: str, obj: Any) -> None:
+    if orjson:
+        Path(path).write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        # stream straight to the file instead of building the whole string first
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(obj, f, indent=2, ensure_ascii=False)
+
 # ---------------- Alias learning ----------------
 def learn_aliases(texts: List[str]) -> Dict[str, str]:
     """Return {table_lower: alias_lower} learned from FROM/JOIN patterns across texts."""
     res: Dict[str, str] = {}
     for t in texts:
         if not t: continue
-        for m in FROM_RX.finditer(t):
-            tbl, alias = m.groups()
-            key = tbl.split(".")[-1].lower()
-            if key and alias and key not in res:
-                res[key] = alias.lower()
-        for m in JOIN_ANY_RX.finditer(t):
-            tbl, alias = m.groups()
-            key = tbl.split(".")[-1].lower()
-            if key and alias and key not in res:
+        hits: Dict[str, list] = {"from": [], "join": []}
+        ends = {"from": 0, "join": 0}
+        for m in FROM_JOIN_RX.finditer(t):
+            kw = m.group(1).lower()
+            if m.start() < ends[kw]:
+                continue  # inside the previous match of the same keyword
+            ends[kw] = m.end(3)
+            hits[kw].append(m.group(2, 3))
+        # FROM declarations take precedence over JOIN ones
+        # (the alias group always matches at least one letter, so only the
+        # table key can come out empty, e.g. for a trailing "schema.")
+        for tbl, alias in chain(hits["from"], hits["join"]):
+            key = tbl.rpartition(".")[2].lower()
+            if key and key not in res:
                 res[key] = alias.lower()
     return res
 
@@ -110,21 +138,31 @@ def unique_alias(base: str, used: set) -> str:
     return f"{base}{i}"
 
 # ---------------- Static value parsing ----------------
+PAREN_NOTE_RX   = re.compile(r"\([^)]*\)")
+TRAIL_DOT_RX    = re.compile(r"\s+\.$")
+TRAIL_DOTS_RX   = re.compile(r"\.+$")
+INT_LIT_RX      = re.compile(r"[+\-]?\d+")
+PADDED_NUM_RX   = re.compile(r"^0{2,}\d*$")
+LEAD_ZEROS_RX   = re.compile(r"^0+")
+
 def _normalize_numeric_literal(val: str) -> str:
-    v = re.sub(r"\([^)]*\)", "", val).strip()
-    v = re.sub(r"\s+\.$", "", v)
-    v = re.sub(r"\.+$", "", v)
-    if re.fullmatch(r"[+\-]?\d+", v):
+    v = PAREN_NOTE_RX.sub("", val).strip()
+    v = TRAIL_DOT_RX.sub("", v)
+    v = TRAIL_DOTS_RX.sub("", v)
+    if INT_LIT_RX.fullmatch(v):
         sign = "-" if v[0] == "-" else ""
         num = v[1:] if v[0] in "+-" else v
-        if re.match(r"^0{2,}\d*$", num):
-            num = re.sub(r"^0+", "", num) or "0"
+        if PADDED_NUM_RX.match(num):
+            num = LEAD_ZEROS_RX.sub("", num) or "0"
         v = f"{sign}{num}"
     return v
 
 STATIC_PATTERNS = re.compile(
     r"(?is)\b(set|assign|value|default)\s*(to|as|=)\s*(.+)$"
 )
+HIGH_DATE_RX     = re.compile(r"9999[-_/]12[-_/]31")
+CURRENT_TS_RX    = re.compile(r"(?i)\bcurrent[_\s]?timestamp\b")
+SINGLE_LETTER_RX = re.compile(r"[a-z]", re.I)
 
 def parse_static_assignment(txt: str, tgt_col: str) -> Optional[Dict[str, Any]]:
     if not isinstance(txt, str) or not txt.strip(): return None
@@ -136,34 +174,40 @@ def parse_static_assignment(txt: str, tgt_col: str) -> Optional[Dict[str, Any]]:
     # canonical transforms
     if "etl.effective.start.date" in low:
         val = "to_date('\"\"\"${etl.effective.start.date}\"\"\"', 'yyyymmddhhmmss')"
-    elif re.search(r"9999[-_/]12[-_/]31", low):
+    elif HIGH_DATE_RX.search(low):
         val = "to_date('9999-12-31', 'yyyy-mm-dd')"
-    elif re.search(r"(?i)\bcurrent[_\s]?timestamp\b", low):
+    elif CURRENT_TS_RX.search(low):
         val = "current_timestamp()"
     else:
         # simple letters like 'n','y','a' keep quoted lower
-        if re.fullmatch(r"[a-z]", val, flags=re.I):
+        if SINGLE_LETTER_RX.fullmatch(val):
             val = f"'{val.lower()}'"
         else:
             val = _normalize_numeric_literal(val)
     return {"value": val, "target_column": str(tgt_col).lower()}
 
 # ---------------- Business rules → SQL ----------------
+DUPLICATE_RX   = re.compile(r"\breject\b.*\bduplicate\b.*\b([a-z_][a-z0-9_]*)\b")
+STATUS_NE_RX   = re.compile(r"status[^a-z0-9]*<>[^a-z0-9]*'a'")
+STATUS_NOT_RX  = re.compile(r"status[^a-z0-9]*not\s*=\s*'a'")
+BLANK_WORDS_RX = re.compile(r"\b(all\s+spaces|blank|empty)\b")
+
 def business_rule_to_sql(text: str, default_alias: str) -> Optional[str]:
     if not text or not text.strip(): return None
     t = text.strip().lower()
 
     # duplicates
-    if re.search(r"\breject\b.*\bduplicate\b.*\b([a-z_][a-z0-9_]*)\b", t):
-        col = re.search(r"\breject\b.*\bduplicate\b.*\b([a-z_][a-z0-9_]*)\b", t).group(1)
+    m = DUPLICATE_RX.search(t)
+    if m:
+        col = m.group(1)
         return f"-- remove duplicates based on {default_alias}.{col}"
 
     # status active
-    if re.search(r"status[^a-z0-9]*<>[^a-z0-9]*'a'", t) or re.search(r"status[^a-z0-9]*not\s*=\s*'a'", t):
+    if STATUS_NE_RX.search(t) or STATUS_NOT_RX.search(t):
         return f"where {default_alias}.srstatus = 'a'"
 
     # all spaces reject
-    if re.search(r"\b(all\s+spaces|blank|empty)\b", t) and "srseccode" in t:
+    if BLANK_WORDS_RX.search(t) and "srseccode" in t:
         return f"where trim({default_alias}.srseccode) <> ''"
 
     # generic "exclude" / "include only"
@@ -191,34 +235,34 @@ def build_derived_from_cases(texts: List[str]) -> List[Dict[str, str]]:
     return out
 
 # ---------------- Lineage ----------------
-def lineage_from_text(text: str, known: List[str], alias: str, src_key: str) -> List[str]:
-    if not text: return []
-    known_set = {k.lower() for k in known}
-    buf = []
-
-    for (q, c) in QUAL_ID_RX.findall(text):
-        buf.append(f"{q.lower()}.{c.lower()}")
-
-    for tok in re.findall(r"[A-Za-z_][A-Za-z0-9_]*", text):
-        t = tok.lower()
+def iter_lineage_terms(text: str, known_set: Set[str], alias: str) -> Iterator[str]:
+    """Yield lineage terms (with repeats) as they are found in text."""
+    if not text: return
+    for m in QUAL_ID_RX.finditer(text):
+        yield f"{m.group(1).lower()}.{m.group(2).lower()}"
+
+    for m in IDENT_RX.finditer(text):
+        t = m.group(0).lower()
         if t in known_set:
-            buf.append(t)
-            buf.append(f"{alias}.{t}")
+            yield t
+            yield f"{alias}.{t}"
 
+def lineage_from_text(text: str, known: List[str], alias: str, src_key: str) -> List[str]:
+    known_set = {k.lower() for k in known}
     # unique in order
-    seen=set(); res=[]
-    for x in buf:
-        if x not in seen:
-            seen.add(x); res.append(x)
-    return res
+    return list(dict.fromkeys(iter_lineage_terms(text, known_set, alias)))
 
 # ---------------- Main extraction ----------------
+def _stripped(items) -> List[str]:
+    """str()+strip() each item once, dropping the empty ones."""
+    return [x for x in (str(x).strip() for x in (items or ())) if x]
+
 def extract_sources_columns(csv_path: str, nlp_path: str, out_json: str, out_md: str):
     df = load_csv(csv_path)
 
     nlp = {}
     if nlp_path and Path(nlp_path).exists():
-        nlp = json.loads(Path(nlp_path).read_text())
+        nlp = read_json(nlp_path)
 
     # collect all texts to learn aliases
     texts_all: List[str] = []
@@ -232,7 +276,7 @@ def extract_sources_columns(csv_path: str, nlp_path: str, out_json: str, out_md:
     used_aliases = set(learned_aliases.values())
 
     # enumerate sources
-    sources = sorted(set(list(df["src_table"].unique()) + list(nlp.keys())))
+    sources = sorted(set(df["src_table"].unique()).union(nlp))
     out: Dict[str, Any] = {}
     md_lines = ["# Source & Column Extraction Report (v4)\n"]
 
@@ -244,61 +288,59 @@ def extract_sources_columns(csv_path: str, nlp_path: str, out_json: str, out_md:
         if not alias:
             alias = unique_alias(src[:4] if len(src) >= 3 else src, used_aliases)
 
+        sdf = df[df["src_table"]==src]
+        n_src = nlp.get(src) or {}
+
         # known columns: csv + nlp
-        csv_cols = [c.strip().lower() for c in df.loc[df["src_table"]==src, "src_column"].dropna().tolist() if c.strip()]
-        nlp_cols = [str(x).strip().lower() for x in (nlp.get(src, {}).get("known_columns") or []) if str(x).strip()]
-        known_cols = []
-        seen=set()
-        for k in (nlp_cols + csv_cols):
-            if k and k not in seen:
-                seen.add(k); known_cols.append(k)
+        csv_cols = [k for k in (c.strip().lower() for c in sdf["src_column"].dropna().tolist()) if k]
+        nlp_cols = [x.lower() for x in _stripped(n_src.get("known_columns"))]
+        known_cols = list(dict.fromkeys(nlp_cols + csv_cols))
 
         # referenced / cases / joins / business
-        n_src = nlp.get(src, {})
-        referenced = [str(x).strip().lower() for x in (n_src.get("referenced_columns") or []) if str(x).strip()]
-        case_texts = [str(x).strip() for x in (n_src.get("case_like_expressions") or []) if str(x).strip()]
+        referenced = [x.lower() for x in _stripped(n_src.get("referenced_columns"))]
+        case_texts = _stripped(n_src.get("case_like_expressions"))
         derived = build_derived_from_cases(case_texts)
 
         # join logic: accept only sql-joins from csv; lowercased + normalized spaces
         joins = []
-        sdf = df[df["src_table"]==src]
         for j in sdf["join_clause"].dropna().unique():
             jj = str(j).strip()
             m = JOIN_STD_RX.search(jj)
             if m:
                 typ, tbl, als, cond = m.groups()
                 typ = (typ or "LEFT").lower()
-                joins.append(re.sub(r"\s+"," ", f"{typ} join {tbl.lower()} {als.lower()} on {cond}"))
+                joins.append(" ".join(f"{typ} join {tbl.lower()} {als.lower()} on {cond}".split()))
         joins = list(dict.fromkeys(joins))
 
         # business rules → sql
         br_sql = []
         # prefer NLP candidate predicates too
-        for w in n_src.get("candidate_where_predicates") or []:
+        for w in n_src.get("candidate_where_predicates") or ():
             br_sql.append(str(w).strip().lower())
         # plus freeform business rule column:
         for b in sdf["business_rule"].dropna().unique():
             sql = business_rule_to_sql(str(b), alias)
             if sql: br_sql.append(sql)
         # dedupe preserving order
-        br_sql = list(dict.fromkeys([re.sub(r"\s+"," ", x.strip()) for x in br_sql if x.strip()]))
+        br_sql = list(dict.fromkeys([" ".join(x.split()) for x in br_sql if x.strip()]))
 
         # static assignments from transformation_rule
         static_assigns = []
-        for _, row in sdf.iterrows():
-            obj = parse_static_assignment(s(row.get("transformation_rule","")), s(row.get("tgt_column","")))
+        # both columns always exist after load_csv; zip them instead of boxing each row
+        for tr, tgt in zip(sdf["transformation_rule"].tolist(), sdf["tgt_column"].tolist()):
+            obj = parse_static_assignment(s(tr), s(tgt))
             if obj: static_assigns.append(obj)
 
         # lineage
-        lineage_terms: List[str] = []
-        for group in [referenced, case_texts, joins, br_sql]:
-            for txt in group:
-                lineage_terms += lineage_from_text(str(txt), known_cols, alias, src)
-        # unique
-        seen=set(); lineage=[]
-        for x in lineage_terms:
-            if x and x not in seen:
-                seen.add(x); lineage.append(x)
+        # stream terms from every text straight into one order-preserving dedupe
+        known_set = {k.lower() for k in known_cols}
+        lineage = list(dict.fromkeys(
+            x
+            for group in (referenced, case_texts, joins, br_sql)
+            for txt in group
+            for x in iter_lineage_terms(str(txt), known_set, alias)
+            if x
+        ))
 
         out[src] = {
             "alias": alias,
@@ -333,7 +375,7 @@ def extract_sources_columns(csv_path: str, nlp_path: str, out_json: str, out_md:
             md_lines.append(f"- lineage sample: {', '.join(lineage[:8])}")
         md_lines.append("")
 
-    Path(out_json).write_text(json.dumps(out, indent=2))
+    write_json(out_json, out)
     Path(out_md).write_text("\n".join(md_lines))
 
 def _cli():
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 import argparse, json, re
-from typing import Dict, List, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
 import pandas as pd
 from pathlib import Path
 
+try:
+    import orjson  # optional: faster JSON serialize
+except ImportError:
+    orjson = None
+
 # ---------------- Canonicalization helpers ----------------
 
 CANON_MAP = {
@@ -25,6 +31,22 @@ CANON_MAP = {
 }
 
 QUAL_ID_RX  = re.compile(r"\b([A-Za-z][A-Za-z0-9_]*)\.([A-Za-z][A-Za-z0-9_]*)\b")
+IDENT_RX    = re.compile(r"[A-Za-z][A-Za-z0-9_]*")
+DIGITS_RX   = re.compile(r"^\d+$")
+TGT_ID_RX   = re.compile(r"(?i)^t_[a-z0-9_]+_\d+$")
+FROM_TAIL_RX = re.compile(r"(?i)\s+\bfrom\b")
+JOIN_TAIL_RX = re.compile(r"(?i)\s+(left|inner|right|full)\s+join\b")
+FROM_ALIAS_RX = re.compile(r"(?i)\bfrom\s+([A-Za-z0-9_\.]+)\s+([A-Za-z][A-Za-z0-9_]*)\b")
+JOIN_ALIAS_RX = re.compile(r"(?i)\bjoin\s+([A-Za-z0-9_\.]+)\s+([A-Za-z][A-Za-z0-9_]*)\b")
+# FROM_ALIAS_RX | JOIN_ALIAS_RX in one scan; the lookahead keeps overlapping hits
+# so each keyword's matches can be replayed exactly as its own finditer would.
+FROM_JOIN_ALIAS_RX = re.compile(r"(?i)(?=\b(from|join)\s+([A-Za-z0-9_\.]+)\s+([A-Za-z][A-Za-z0-9_]*)\b)")
+SQL_OP_RX   = re.compile(r"\b(=|<>|>=|<=|>|<| like | in | is null| is not null)\b")
+CASE_WORD_RX = re.compile(r"\bCASE\b", re.I)
+CASE_SEG_RX = re.compile(r"(?is)(CASE .*? END)")
+WHERE_RX    = re.compile(r"(?i)\bwhere\b")
+FRAG_SPLIT_RX = re.compile(r"\.|\;|\band\b", re.I)
+STATUS_NOT_A_RX = re.compile(r"SRSTATUS\s*<>\s*'A'", re.I)
 
 def s(x) -> str:
     if x is None:
@@ -77,24 +99,24 @@ def load_csv(path: str) -> pd.DataFrame:
     df["src_table"] = df["src_table"].apply(lambda v: str(v).strip().split()[0].lower() if str(v).strip() else "")
     return df
 
-def learn_source_columns(df: pd.DataFrame) -> Dict[str, Set[str]]:
-    out: Dict[str, Set[str]] = {}
-    for _, row in df.iterrows():
-        t = str(row.get("src_table","")).strip().lower()
-        c = str(row.get("src_column","")).strip()
-        if not t or not c:
+def learn_source_columns(sdf: pd.DataFrame) -> Set[str]:
+    """Source columns named on one source's rows (sdf is that source's group)."""
+    out: Set[str] = set()
+    for v in sdf["src_column"]:
+        c = str(v).strip()
+        if not c:
             continue
         # ignore misfiled target-id tokens
-        if re.match(r"(?i)^t_[a-z0-9_]+_\d+$", c): 
+        if TGT_ID_RX.match(c): 
             continue
         if c.lower() == "nan":
             continue
-        out.setdefault(t, set()).add(c)
+        out.add(c)
     return out
 
 def strip_from_join(expr: str) -> str:
-    e = re.split(r"(?i)\s+\bfrom\b", expr)[0]
-    e = re.split(r"(?i)\s+(left|inner|right|full)\s+join\b", e)[0]
+    e = FROM_TAIL_RX.split(expr)[0]
+    e = JOIN_TAIL_RX.split(e)[0]
     return e.strip()
 
 # ---------------- Alias handling ----------------
@@ -107,30 +129,38 @@ DEFAULT_ALIASES = {
     "tantrum": "tant",
 }
 
+GENERIC_ALIASES = frozenset({"ref", "ref1", "ref2", "ref3"})
+
 def prefer_default_if_generic(src: str, alias: str) -> str:
-    if alias.lower() in {"ref", "ref1", "ref2", "ref3"}:
-        return DEFAULT_ALIASES.get(src.lower(), alias.lower())
-    return alias.lower()
+    a = alias.lower()
+    if a in GENERIC_ALIASES:
+        return DEFAULT_ALIASES.get(src.lower(), a)
+    return a
 
 def find_alias_for_source_v6(source: str, texts: List[str]) -> str:
     """Prefer alias from text; if it's too generic (ref/ref1/...), swap to deterministic default."""
     src = source.lower()
     for txt in texts:
-        norm = re.sub(r"\s+", " ", txt.strip())
-        # FROM tbl alias
-        for m in re.finditer(r"(?i)\bfrom\s+([A-Za-z0-9_\.]+)\s+([A-Za-z][A-Za-z0-9_]*)\b", norm):
-            tbl, alias = m.group(1), m.group(2)
-            if alias.lower() in ("on","with","join"):
+        norm = " ".join(txt.split())
+        # FROM tbl alias wins over JOIN tbl alias within the same text
+        join_alias = None
+        ends = {"from": 0, "join": 0}
+        for m in FROM_JOIN_ALIAS_RX.finditer(norm):
+            kw = m.group(1).lower()
+            if m.start() < ends[kw]:
+                continue  # inside the previous match of the same keyword
+            ends[kw] = m.end(3)
+            if kw == "join" and join_alias:
                 continue
-            if tbl.split(".")[-1].lower() == src:
-                return prefer_default_if_generic(src, alias)
-        # JOIN tbl alias
-        for m in re.finditer(r"(?i)\bjoin\s+([A-Za-z0-9_\.]+)\s+([A-Za-z][A-Za-z0-9_]*)\b", norm):
-            tbl, alias = m.group(1), m.group(2)
-            if alias.lower() in ("on","with","join"):
+            tbl, alias = m.group(2), m.group(3).lower()
+            if alias in ("on","with","join"):
                 continue
-            if tbl.split(".")[-1].lower() == src:
-                return prefer_default_if_generic(src, alias)
+            if tbl.rpartition(".")[2].lower() == src:
+                if kw == "from":
+                    return prefer_default_if_generic(src, alias)
+                join_alias = alias
+        if join_alias:
+            return prefer_default_if_generic(src, join_alias)
     # fallback deterministic
     return DEFAULT_ALIASES.get(src, (src[:4] if src else "src")).lower()
 
@@ -143,19 +173,23 @@ def harvest_identifiers_for_source(src: str, texts: List[str], known_cols: Set[s
     pat = re.compile(rf"\b(?:{re.escape(a)}|{re.escape(src_low)})\.([A-Za-z][A-Za-z0-9_]*)\b")
     for t in texts:
         for col in pat.findall(t):
-            if col.lower() not in seen:
-                seen.add(col.lower()); out.append(col)
+            key = col.lower()
+            if key not in seen:
+                seen.add(key); out.append(col)
         # unqualified tokens that match known cols
-        for tok in re.findall(r"[A-Za-z][A-Za-z0-9_]*", t):
-            if tok in known_cols and tok.lower() not in seen:
-                seen.add(tok.lower()); out.append(tok)
+        for tok in IDENT_RX.findall(t):
+            if tok in known_cols:
+                key = tok.lower()
+                if key not in seen:
+                    seen.add(key); out.append(tok)
     return out
 
 def enrich_columns_from_case(src: str, alias: str, texts: List[str], known_cols: Set[str]) -> Set[str]:
     extra = set()
+    owners = (src.lower(), alias.lower())
     for txt in [t for t in texts if "CASE" in t.upper()]:
         for (qual, col) in QUAL_ID_RX.findall(txt):
-            if qual.lower() in (src.lower(), alias.lower()) and not re.match(r"^\d+$", col):
+            if qual.lower() in owners and not DIGITS_RX.match(col):
                 extra.add(col)
     return set(known_cols).union(extra)
 
@@ -166,43 +200,55 @@ DEV_NOTE_WORDS = [
     "entity details", "for info", "then match", "if a match found", "note:", "format"
 ]
 
+def sql_predicate_checker(alias: str, known_cols: Set[str]) -> Callable[[str], bool]:
+    """Build looks_like_sql_predicate for one alias, compiling its alias.col pattern once."""
+    qual_rx = re.compile(rf"\b{re.escape(alias.lower())}\.[A-Za-z][A-Za-z0-9_]*\b")
+    # every known column in one alternation: a single scan instead of one per column
+    cols = sorted({re.escape(col.lower()) for col in known_cols})
+    col_rx = re.compile(rf"\b(?:{'|'.join(cols)})\b") if cols else None
+
+    def check(line: str) -> bool:
+        L = line.lower()
+        if any(w in L for w in DEV_NOTE_WORDS): return False
+        if " join " in L or " with " in L or " from " in L: return False
+        # must contain an operator
+        if not SQL_OP_RX.search(L):
+            return False
+        # must reference alias.col or a known column token
+        qual_ok = bool(qual_rx.search(L))
+        return qual_ok or bool(col_rx and col_rx.search(L))
+
+    return check
+
 def looks_like_sql_predicate(line: str, alias: str, known_cols: Set[str]) -> bool:
-    L = line.lower()
-    if any(w in L for w in DEV_NOTE_WORDS): return False
-    if " join " in L or " with " in L or " from " in L: return False
-    # must contain an operator
-    if not re.search(r"\b(=|<>|>=|<=|>|<| like | in | is null| is not null)\b", L):
-        return False
-    # must reference alias.col or a known column token
-    qual_ok = bool(re.search(rf"\b{re.escape(alias.lower())}\.[A-Za-z][A-Za-z0-9_]*\b", L))
-    unqual_ok = any(re.search(rf"\b{re.escape(col.lower())}\b", L) for col in known_cols)
-    return qual_ok or unqual_ok
+    return sql_predicate_checker(alias, known_cols)(line)
 
 def extract_case_and_filter_blocks_v6(texts: List[str], alias: str, known_cols: Set[str]):
     case_blocks, where_blocks = [], []
+    is_predicate = sql_predicate_checker(alias, known_cols)
     for raw in texts:
         t = s(raw)
         if not t: continue
-        t_norm = re.sub(r"\s+", " ", t)
+        t_norm = " ".join(t.split())
 
         # CASE harvesting
-        if re.search(r"\bCASE\b", t_norm, re.I):
+        if CASE_WORD_RX.search(t_norm):
             clean_case = strip_from_join(t_norm)
-            segs = re.findall(r"(?is)(CASE .*? END)", clean_case)
+            segs = CASE_SEG_RX.findall(clean_case)
             if segs: case_blocks.extend([seg.strip() for seg in segs])
             else: case_blocks.append(clean_case.strip())
             continue
 
         # WHERE or predicate-like phrases (strict)
-        parts = re.split(r"(?i)\bwhere\b", t_norm)
+        parts = WHERE_RX.split(t_norm)
         if len(parts) > 1:
             cond = parts[-1].strip()
-            if looks_like_sql_predicate(cond, alias, known_cols):
+            if is_predicate(cond):
                 where_blocks.append(cond)
         else:
-            for frag in re.split(r"\.|\;|\band\b", t_norm, flags=re.I):
+            for frag in FRAG_SPLIT_RX.split(t_norm):
                 frag = frag.strip()
-                if looks_like_sql_predicate(frag, alias, known_cols):
+                if is_predicate(frag):
                     where_blocks.append(frag)
 
     # dedup
@@ -220,51 +266,72 @@ def extract_case_and_filter_blocks_v6(texts: List[str], alias: str, known_cols:
 
     return clean_case, clean_where
 
+# ---------------- JSON output ----------------
+
+def write_json(path: Path, obj) -> None:
+    if orjson:
+        path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        # stream straight to the file instead of building the whole string first
+        with path.open("w", encoding="utf-8") as f:
+            json.dump(obj, f, indent=2, ensure_ascii=False)
+
 # ---------------- Main parse ----------------
 
-def parse_rules(csv_path: str, outdir: str) -> Dict[str, Dict]:
+def interpret_source(src: str, texts: List[str], known_cols: Set[str]) -> Dict:
+    """Interpret one source's free-text rules; independent of every other source."""
+    alias = find_alias_for_source_v6(src, texts)
+    known_cols = enrich_columns_from_case(src, alias, texts, known_cols)
+    referenced_cols = harvest_identifiers_for_source(src, texts, known_cols, alias)
+    case_blocks, where_blocks = extract_case_and_filter_blocks_v6(texts, alias, known_cols)
+
+    # derive mas.SRSTATUS = 'A' when we see "exclude inactive"/"<> 'A'"
+    # (one hit is enough: the predicate is the same for every matching text)
+    inferred = []
+    if any(STATUS_NOT_A_RX.search(t) or "exclude inactive" in t.lower() for t in texts):
+        inferred.append(f"{alias}.SRSTATUS = 'A'")
+    where_blocks = sorted({*where_blocks, *inferred})
+
+    return {
+        "alias": alias,
+        "known_columns": sorted(known_cols),
+        # already unique (deduped case-insensitively while harvesting)
+        "referenced_columns": sorted(referenced_cols),
+        "candidate_where_predicates": where_blocks,
+        "case_like_expressions": case_blocks,
+    }
+
+def parse_rules(csv_path: str, outdir: str, workers: int = 1) -> Dict[str, Dict]:
     df = load_csv(csv_path)
 
-    per_source: Dict[str, Dict[str, List[str]]] = {}
-    for src in sorted(set(df["src_table"].astype(str).str.strip().str.lower())):
+    # one walk over the source groups collects both the rule texts and the
+    # known columns each source needs
+    per_source: Dict[str, Dict] = {}
+    src_keys = df["src_table"].astype(str).str.strip().str.lower()
+    for src, sdf in df.groupby(src_keys, sort=True):
         if not src: continue
-        sdf = df[df["src_table"].astype(str).str.strip().str.lower() == src]
         texts: List[str] = []
         for c in ["join_clause","business_rule","transformation_rule"]:
             if c in sdf.columns:
                 ser = sdf[c]
                 if isinstance(ser, pd.DataFrame): ser = ser.iloc[:,0]
-                texts.extend([s(v) for v in ser if s(v)])
-        per_source[src] = {"texts": texts}
-
-    src_cols_map = learn_source_columns(df)
-    interpretation: Dict[str, Dict] = {}
-
-    for src, bundle in per_source.items():
-        texts = bundle["texts"]
-        alias = find_alias_for_source_v6(src, texts)
-        known_cols = src_cols_map.get(src.lower(), set())
-        known_cols = enrich_columns_from_case(src, alias, texts, known_cols)
-        referenced_cols = harvest_identifiers_for_source(src, texts, known_cols, alias)
-        case_blocks, where_blocks = extract_case_and_filter_blocks_v6(texts, alias, known_cols)
-
-        # derive mas.SRSTATUS = 'A' when we see "exclude inactive"/"<> 'A'"
-        inferred = []
-        for t in texts:
-            if re.search(r"SRSTATUS\s*<>\s*'A'", t, re.I) or "exclude inactive" in t.lower():
-                inferred.append(f"{alias}.SRSTATUS = 'A'")
-        where_blocks = sorted(set(where_blocks + inferred))
-
-        interpretation[src] = {
-            "alias": alias,
-            "known_columns": sorted(list(known_cols)),
-            "referenced_columns": sorted(set(referenced_cols)),
-            "candidate_where_predicates": where_blocks,
-            "case_like_expressions": case_blocks,
-        }
+                texts.extend(t for t in map(s, ser) if t)
+        per_source[src] = {"texts": texts, "cols": learn_source_columns(sdf)}
+
+    srcs = list(per_source)
+    texts_by_src = [per_source[src]["texts"] for src in srcs]
+    cols_by_src = [per_source[src]["cols"] for src in srcs]
+
+    # sources are independent, so large mappings can fan out across processes
+    if workers > 1 and len(srcs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(interpret_source, srcs, texts_by_src, cols_by_src))
+    else:
+        results = list(map(interpret_source, srcs, texts_by_src, cols_by_src))
+    interpretation: Dict[str, Dict] = dict(zip(srcs, results))
 
     out = Path(outdir); out.mkdir(parents=True, exist_ok=True)
-    (out / "nlp_rules_interpretation_v6.json").write_text(json.dumps(interpretation, indent=2))
+    write_json(out / "nlp_rules_interpretation_v6.json", interpretation)
 
     # Also emit a quick markdown for eyeballing
     lines = ["# NLP Parsing Report v6\n"]
@@ -292,5 +359,6 @@ if __name__ == "__main__":
     p = argparse.ArgumentParser(description="NLP parser for dev free-text joins/filters/cases.")
     p.add_argument("csv", help="Path to source-target mapping CSV")
     p.add_argument("--outdir", required=True, help="Output directory")
+    p.add_argument("--workers", type=int, default=1, help="Parallel processes for per-source parsing")
     args = p.parse_args()
-    parse_rules(args.csv, args.outdir)
+    parse_rules(args.csv, args.outdir, args.workers)
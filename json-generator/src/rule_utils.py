@@ -1,5 +1,6 @@
 # rule_utils.py (v6) — preserves multi-line CASE logic; builds auditable WHERE; normalizes joins
 import re
+from functools import lru_cache
 from typing import List, Tuple, Optional
 
 # ---------- Debug hooks (kept light; file-writer lives in build script) ----------
@@ -14,17 +15,31 @@ def _debug_log(title: str, block: str):
 # ---------- Small utils ----------
 
 def squash(s: str) -> str:
-    return re.sub(r"\s+", " ", (s or "")).strip()
+    return " ".join((s or "").split())
+
+_LOG_EXCEPTION_TAIL = re.compile(r"(?i)\blog an exception.*")
 
 def clean_free_text(s: str) -> str:
     if not isinstance(s, str) or not s.strip():
         return ""
     # keep SQL-ish text; drop trailing “log an exception …” noise commonly found
-    s = re.sub(r"(?i)\blog an exception.*", "", s)
+    s = _LOG_EXCEPTION_TAIL.sub("", s)
     return s.strip()
 
 # ---------- Business Rules → WHERE ----------
 
+# business-rule predicate hints (compiled once; tested on every rule line)
+_DUPLICATE_SECCODE = re.compile(r"(?i)\bduplicate\b.*\bossbr_2_1\.SRSECCODE\b")
+_SECCODE_ALL_SPACES = re.compile(r"(?i)ossbr_2_1\.SRSECCODE.*all\s+spaces")
+_STATUS_NOT_A = re.compile(r"(?i)ossbr_2_1\.SRSTATUS\s*<>?\s*'A'")
+_NOT_ACTIVE = re.compile(r"(?i)not\s+active")
+_GLSXREF = re.compile(r"(?i)GLSXREF")
+_SBB = re.compile(r"(?i)SBB")
+_MFSPRIC = re.compile(r"(?i)MFSPRIC")
+_REJECT_RECORD = re.compile(r"(?i)\breject the record\b")
+_EXCLUDE_RECORD = re.compile(r"(?i)\bexclude the record\b")
+_BULLET_SPLIT = re.compile(r"(?:^\s*\d+\)\s*|\n)+")
+
 def _extract_predicates_from_lines(lines: List[str]) -> Tuple[List[str], List[str]]:
     preds, notes = [], []
     for ln in lines:
@@ -33,19 +48,19 @@ def _extract_predicates_from_lines(lines: List[str]) -> Tuple[List[str], List[st
             continue
 
         # “duplicate” hint → ROW_NUMBER TODO note (kept as comment)
-        if re.search(r"(?i)\bduplicate\b.*\bossbr_2_1\.SRSECCODE\b", l):
+        if _DUPLICATE_SECCODE.search(l):
             notes.append("-- TODO: Duplicates: enforce ROW_NUMBER() OVER (PARTITION BY mas.SRSECCODE ORDER BY <choose>) = 1")
 
         # “all spaces” on SRSECCODE
-        if re.search(r"(?i)ossbr_2_1\.SRSECCODE.*all\s+spaces", l):
+        if _SECCODE_ALL_SPACES.search(l):
             preds.append("TRIM(mas.SRSECCODE) <> ''")
 
         # SRSTATUS <> 'A' → keep only active
-        if re.search(r"(?i)ossbr_2_1\.SRSTATUS\s*<>?\s*'A'", l) or re.search(r"(?i)not\s+active", l):
+        if _STATUS_NOT_A.search(l) or _NOT_ACTIVE.search(l):
             preds.append("mas.SRSTATUS = 'A'")
 
         # Mutual fund / SBB already extracted rule
-        if re.search(r"(?i)GLSXREF", l) and re.search(r"(?i)SBB", l) and re.search(r"(?i)MFSPRIC", l):
+        if _GLSXREF.search(l) and _SBB.search(l) and _MFSPRIC.search(l):
             preds.append(
                 "NOT (ref.WASTE_SECURITY_CODE = mas.SRSECCODE "
                 "AND LEFT(ref.FUND_COMPANY,3) = 'SBB' "
@@ -53,20 +68,22 @@ def _extract_predicates_from_lines(lines: List[str]) -> Tuple[List[str], List[st
             )
 
         # “exclude” / “reject” notes preserved
-        if re.search(r"(?i)\breject the record\b", l):
+        if _REJECT_RECORD.search(l):
             notes.append(f"-- NOTE: Evaluate rule -> {l}")
-        if re.search(r"(?i)\bexclude the record\b", l):
+        if _EXCLUDE_RECORD.search(l):
             notes.append(f"-- NOTE: Exclusion rule -> {l}")
 
     return preds, notes
 
+@lru_cache(maxsize=1024)
 def business_rules_to_where(biz_text: str) -> str:
-    """Convert enumerated/paragraph business rules into a WHERE block with audit comments."""
+    """Convert enumerated/paragraph business rules into a WHERE block with audit comments.
+    Memoized: the same business_rule text is usually repeated on every mapping row."""
     if not biz_text:
         return ""
     text = clean_free_text(biz_text)
     # split by bullets like "1)" and by newlines; keep content
-    items = re.split(r"(?:^\s*\d+\)\s*|\n)+", text)
+    items = _BULLET_SPLIT.split(text)
     items = [i for i in items if i and i.strip()]
     preds, notes = _extract_predicates_from_lines(items)
     body = []
@@ -77,21 +94,25 @@ def business_rules_to_where(biz_text: str) -> str:
 
 # ---------- Transformation parsing (CASE preservation) ----------
 
+_SET_TO_LITERAL = re.compile(r"(?i)\bset\s+to\s+(.+?)(?:\s*$|\.)")
+_TRAILING_PAREN = re.compile(r"\s*\(.*?\)\s*$")
+_PLUS_CODE = re.compile(r"^\+\d+")
+
 def parse_literal_set(trans: str) -> Optional[str]:
     """Detect 'Set to <X>' patterns → return a SQL literal."""
     if not trans:
         return None
-    m = re.search(r"(?i)\bset\s+to\s+(.+?)(?:\s*$|\.)", trans.strip())
+    m = _SET_TO_LITERAL.search(trans.strip())
     if not m:
         return None
     val = m.group(1).strip()
     # strip trailing parenthetical notes like (DB)
-    val = re.sub(r"\s*\(.*?\)\s*$", "", val).strip()
+    val = _TRAILING_PAREN.sub("", val).strip()
     # numeric?
-    if re.fullmatch(r"[-+]?\d+(\.\d+)?", val):
+    if _NUMERIC_LIT.fullmatch(val):
         return val
     # +01342-like codes
-    if re.match(r"^\+\d+", val):
+    if _PLUS_CODE.match(val):
         return f"'{val}'"
     # as text literal
     return "'" + val.strip("'\"") + "'"
@@ -121,6 +142,25 @@ def extract_case_core(trans_text: str) -> Tuple[str, str]:
 
 # ---------- Smart datatype helpers (for casting) ----------
 
+_ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+_STRUCTURED_EXPR = re.compile(r"(?i)^(CASE|CAST|TO_DATE|COALESCE|CURRENT_TIMESTAMP)\b")
+_NUMERIC_LIT = re.compile(r"[-+]?\d+(\.\d+)?")
+_QUOTED_LIT = re.compile(r"'[^']*'")
+
+def _is_int_literal(v: str) -> bool:
+    """Hand-rolled scan equivalent to re.fullmatch(r"[-+]?\\d+", v)."""
+    if v[:1] in ("-", "+"):
+        v = v[1:]
+    return v.isdecimal()
+
+def _is_decimal_literal(v: str) -> bool:
+    """Hand-rolled scan equivalent to re.fullmatch(r"[-+]?\\d+\\.\\d+", v)."""
+    if v[:1] in ("-", "+"):
+        v = v[1:]
+    whole, dot, frac = v.partition(".")
+    return bool(dot) and whole.isdecimal() and frac.isdecimal()
+
+@lru_cache(maxsize=4096)
 def _infer_datatype_from_value(value: str, explicit_type: Optional[str]) -> str:
     """Prefer explicit CSV type; else infer: numeric -> BIGINT, decimalx -> DECIMAL, quoted -> STRING."""
     if explicit_type and explicit_type.strip():
@@ -130,16 +170,17 @@ def _infer_datatype_from_value(value: str, explicit_type: Optional[str]) -> str:
     v = str(value).strip()
 
     # numeric (integer-like)
-    if re.fullmatch(r"[-+]?\d+", v):
+    if _is_int_literal(v):
         return "BIGINT"
     # decimal
-    if re.fullmatch(r"[-+]?\d+\.\d+", v):
+    if _is_decimal_literal(v):
         return "DECIMAL(17,2)"
-    # date-ish keywords
-    if "to_date(" in v.lower() or re.search(r"\d{4}-\d{2}-\d{2}", v):
+    # date-ish keywords (the '-' probe skips the regex for plain strings)
+    if "to_date(" in v.lower() or ("-" in v and _ISO_DATE.search(v)):
         return "DATE"
     return "STRING"
 
+@lru_cache(maxsize=4096)
 def _cast_to_datatype(expr: str, target_datatype: str, default_val: Optional[str] = None) -> str:
     """
     Return expr casted to the given type. Handles NULL specially and keeps function calls unquoted.
@@ -159,22 +200,14 @@ def _cast_to_datatype(expr: str, target_datatype: str, default_val: Optional[str
         return f"CAST(NULL AS {dt})"
 
     # Avoid re-casting structured expressions (CASE, TO_DATE, CAST)
-    if re.match(r"(?i)^(CASE|CAST|TO_DATE|COALESCE|CURRENT_TIMESTAMP)\b", e):
+    if _STRUCTURED_EXPR.match(e):
         return e
 
-    # Numeric literals
-    if re.fullmatch(r"[-+]?\d+(\.\d+)?", e.strip("'")):
-        val = e.strip("'")
+    # Numeric literals (bare or quoted) are cast unquoted; everything else,
+    # including quoted text, is cast as-is.
+    val = e.strip("'")
+    if _is_int_literal(val) or _is_decimal_literal(val):
         return f"CAST({val} AS {dt})"
-
-
-    # Quoted string
-    if re.fullmatch(r"'[^']*'", e):
-        inner = e.strip("'")
-        if re.fullmatch(r"[-+]?\d+(\.\d+)?", inner):
-            return f"CAST({inner} AS {dt})"
-        return f"CAST({e} AS {dt})"
-
     return f"CAST({e} AS {dt})"
 
 # ---------- Utility: determine when to CAST ----------
@@ -193,24 +226,43 @@ def _needs_cast(expr: str) -> bool:
     """
     if not expr or not isinstance(expr, str):
         return False
-    ex = expr.strip().upper()
+    e = expr.strip()
+    ex = e.upper()
 
     # Already a structured SQL expression — skip casting
-    if any(keyword in ex for keyword in ["CAST(", "COALESCE(", "TO_DATE(", "CURRENT_TIMESTAMP", "CASE "]):
+    if any(keyword in ex for keyword in ("CAST(", "COALESCE(", "TO_DATE(", "CURRENT_TIMESTAMP", "CASE ")):
         return False
 
     # Simple numeric literal or quoted string literal
-    if re.fullmatch(r"[-+]?\d+(\.\d+)?", expr.strip().strip("'")):
+    if _NUMERIC_LIT.fullmatch(e.strip("'")):
         return True
-    if re.fullmatch(r"'[^']*'", expr.strip()):
+    if _QUOTED_LIT.fullmatch(e):
         return True
-    if expr.strip().upper() == "NULL":
+    if ex == "NULL":
         return True
 
     return False
 
 # ---------- Main transformation expression ----------
 
+# parse_set_rule patterns (compiled once; the parser runs for every rule text)
+_SET_NULL_IF = re.compile(r"set\s+to\s+null\s+if")
+_COND_DEFAULT = re.compile(
+    r"(if|when)\s+(blank|empty|null|missing)[^a-z0-9]+(then|use|set|assign|pass)\s+(['\"]?[-\w\.]+['\"]?)",
+    re.I,
+)
+_ISO_DATE_GROUP = re.compile(r"(\d{4}-\d{2}-\d{2})")
+_SET_X_TO = re.compile(r"(?i)set(?:\s+\w+)?\s+to\s+(.+)$")
+_DEV_COMMENT = re.compile(r"--.*")
+_PADDED_INT = re.compile(r"[+]?0*\d+")
+_PLUS_ZEROS = re.compile(r"^[+]?0*")
+_STRAIGHT_MOVE = re.compile(r"straight\s*move", re.I)
+_DATE_FORMAT_HINT = re.compile(r"yyyy[-/]mm[-/]dd", re.I)
+_DATE_FIELD_HINT = re.compile(r"date\s*field", re.I)
+_SET_TO_WORDS = re.compile(r"(?i)\bset\s+to\b")
+_SET_WORD = re.compile(r"(?i)\bset\b")
+_SQL_KEYWORD = re.compile(r"\b(case|when|select|join|from)\b", re.I)
+
 def parse_set_rule(rule_text: str) -> Optional[str]:
     """Detects and converts free-form 'Set to ...' or 'Straight move' rules into valid SQL expressions.
        Enhanced (Patch 9): 
@@ -239,21 +291,17 @@ def parse_set_rule(rule_text: str) -> Optional[str]:
         return "TO_DATE('\"\"\"${etl.effective.start.date}\"\"\"', 'yyyyMMddHHmmss')"
 
     # Conditional NULL patterns (simple heuristic)
-    if re.search(r"set\s+to\s+null\s+if", text):
+    if _SET_NULL_IF.search(text):
         # we return a placeholder; build layer can expand with src_col
         return "CASE WHEN {source_column} IS NULL OR TRIM({source_column})='' THEN NULL ELSE {source_column} END"
 
     # 🟢 NEW: Smart default detection for conditional rules
     # Matches: "if blank then 0", "if empty pass 0", "when null assign 1", etc.
-    m_default = re.search(
-        r"(if|when)\s+(blank|empty|null|missing)[^a-z0-9]+(then|use|set|assign|pass)\s+(['\"]?[-\w\.]+['\"]?)",
-        text,
-        re.I,
-    )
+    m_default = _COND_DEFAULT.search(text)
     if m_default:
         val = m_default.group(4).strip("'\" ")
         # numeric or decimal
-        if re.fullmatch(r"[-+]?\d+(\.\d+)?", val):
+        if _NUMERIC_LIT.fullmatch(val):
             return f"COALESCE({{source_column}}, {val})"
         # NULL explicitly
         if val.lower() == "null":
@@ -262,7 +310,7 @@ def parse_set_rule(rule_text: str) -> Optional[str]:
         return f"COALESCE({{source_column}}, '{val}')"
 
     # Dates like 9999-12-31 (optionally with cast directions)
-    mdate = re.search(r"(\d{4}-\d{2}-\d{2})", original)
+    mdate = _ISO_DATE_GROUP.search(original)
     if mdate:
         d = mdate.group(1)
         if "cast" in text:
@@ -270,40 +318,40 @@ def parse_set_rule(rule_text: str) -> Optional[str]:
         return f"'{d}'"
 
     # “Set X to Y” or “Set to Y” (strip developer notes in parentheses)
-    m = re.search(r"(?i)set(?:\s+\w+)?\s+to\s+(.+)$", original)
+    m = _SET_X_TO.search(original)
     if m:
         val = m.group(1).strip().rstrip(".")
         # 🩹 FIX: remove inline comment markers like "--1A" first
-        val = re.sub(r"--.*", "", val).strip()
+        val = _DEV_COMMENT.sub("", val).strip()
         # remove trailing parenthetical commentary
-        val = re.sub(r"\s*\(.*?\)\s*$", "", val).strip()
+        val = _TRAILING_PAREN.sub("", val).strip()
 
         # +00331 → 331 (strip leading plus zeros if numeric)
-        if re.fullmatch(r"[+]?0*\d+", val):
-            num = re.sub(r"^[+]?0*", "", val) or "0"
+        if _PADDED_INT.fullmatch(val):
+            num = _PLUS_ZEROS.sub("", val) or "0"
             return num
         # plain quoted or bare tokens
-        if re.fullmatch(r"[-+]?\d+(\.\d+)?", val):
+        if _NUMERIC_LIT.fullmatch(val):
             return val
-        if re.fullmatch(r"'[^']*'", val):
+        if _QUOTED_LIT.fullmatch(val):
             return val
         val_clean = val.strip().strip("'").strip('"')
         return f"'{val_clean}'"
 
     # 🟢 Handle "Straight move" patterns
-    if re.search(r"straight\s*move", text, re.I):
-        if re.search(r"yyyy[-/]mm[-/]dd", text, re.I) or re.search(r"date\s*field", text, re.I):
+    if _STRAIGHT_MOVE.search(text):
+        if _DATE_FORMAT_HINT.search(text) or _DATE_FIELD_HINT.search(text):
             return "TO_DATE({source_column}, 'YYYY-MM-DD')"
         else:
             return "{source_column}"
 
     # fallback: strip comment markers and boilerplate
-    cleaned = re.sub(r"--.*", "", original)
-    cleaned = re.sub(r"(?i)\bset\s+to\b", "", cleaned)
-    cleaned = re.sub(r"(?i)\bset\b", "", cleaned).strip(" :\"'")
+    cleaned = _DEV_COMMENT.sub("", original)
+    cleaned = _SET_TO_WORDS.sub("", cleaned)
+    cleaned = _SET_WORD.sub("", cleaned).strip(" :\"'")
 
     # 🩹 Fix: prevent wrapping CASE or SQL fragments in quotes
-    if re.search(r"\b(case|when|select|join|from)\b", cleaned, re.I):
+    if _SQL_KEYWORD.search(cleaned):
         return cleaned
 
     if cleaned.upper() == "NULL":
@@ -316,6 +364,12 @@ def transformation_expression(trans: str, target_col: str, src_col: str, target_
     Returns:
       (expression_sql, trailing_comment_or_None)
     """
+    # target_col/target_datatype don't affect the result, so the memo is keyed
+    # on (trans, src_col) and boilerplate rules hit it across target columns
+    return _transformation_expression_cached(trans, src_col)
+
+@lru_cache(maxsize=4096)
+def _transformation_expression_cached(trans: str, src_col: str) -> Tuple[str, Optional[str]]:
     trans = clean_free_text(trans)
     if not trans:
         expr = src_col or "NULL"
@@ -364,23 +418,44 @@ def normalize_join(join_text: str) -> str:
     if not join_text:
         return ""
 
+    s_final = _normalize_join_cached(join_text)
+
+    if DEBUG_JOINS:
+        _debug_log("JOIN NORMALIZATION", s_final)
+
+    return s_final
+
+# normalize_join patterns, in the order the body applies them
+_WITH_WORD = re.compile(r"(?i)\bwith\b")
+_INNER_JOIN = re.compile(r"(?i)\binner\s+join\b")
+_JOIN_WORD = re.compile(r"(?i)\bjoin\b")
+_SEMI_OR_NEWLINE = re.compile(r"[;\n]+")
+_STRAY_FROM = re.compile(r"\s+FROM\s+[A-Za-z0-9_\. ]+(?=(\s+(LEFT|INNER|RIGHT|FULL)\s+JOIN\b|\s*$))", re.I)
+_JOIN_WITH_PHRASE = re.compile(r"(?i)\bjoin\s+\S+\s+with\s+([A-Za-z0-9_]+)\s+([A-Za-z0-9_]+)")
+_LEFT_JOIN_ON = re.compile(r"LEFT JOIN\s+([A-Za-z0-9_]+(?:\s+[A-Za-z0-9_]+)*)\s+ON\s+(.*)", re.I)
+_OUTER_JOIN_TYPE = re.compile(r"(?i)\b(left|right|full)\s+join\b")
+_LOOKUP_TABLE = re.compile(r"(?i)\b(_ref|_lkp|_xref|_map|_dim)\b")
+_NON_LEFT_JOIN_TYPE = re.compile(r"(?i)\b(inner|right|full)\s+join\b")
+
+@lru_cache(maxsize=1024)
+def _normalize_join_cached(join_text: str) -> str:
+    """Pure body of normalize_join; the same join_clause text repeats across many rows."""
     # Basic cleanup
     s = clean_free_text(join_text).strip()
-    s = re.sub(r"(?i)\bwith\b", " ", s)
-    s = re.sub(r"(?i)\binner\s+join\b", "JOIN", s)
-    s = re.sub(r"(?i)\bjoin\b", "JOIN", s)
-    s = re.sub(r"[;\n]+", " ", s)
+    s = _WITH_WORD.sub(" ", s)
+    s = _INNER_JOIN.sub("JOIN", s)
+    s = _JOIN_WORD.sub("JOIN", s)
+    s = _SEMI_OR_NEWLINE.sub(" ", s)
 
     # ---- Strip any stray FROM ... fragments (should not live inside JOIN text)
     # keep only "<JOIN ... ON <cond>>" and drop accidental trailing FROM clauses
-    s = re.sub(r"\s+FROM\s+[A-Za-z0-9_\. ]+(?=(\s+(LEFT|INNER|RIGHT|FULL)\s+JOIN\b|\s*$))", "", s, flags=re.I)
+    s = _STRAY_FROM.sub("", s)
 
     # ---- Fix odd "JOIN <A> WITH <B> <alias>" phrasing → "LEFT JOIN <B> <alias>"
-    s = re.sub(r"(?i)\bjoin\s+\S+\s+with\s+([A-Za-z0-9_]+)\s+([A-Za-z0-9_]+)",
-               r"LEFT JOIN \1 \2", s)
+    s = _JOIN_WITH_PHRASE.sub(r"LEFT JOIN \1 \2", s)
 
     # ---- If multiple JOIN blocks got glued together, keep the last table+alias before ON
-    m = re.search(r"LEFT JOIN\s+([A-Za-z0-9_]+(?:\s+[A-Za-z0-9_]+)*)\s+ON\s+(.*)", s, re.I)
+    m = _LEFT_JOIN_ON.search(s)
     if m:
         table_block = m.group(1)
         cond = m.group(2)
@@ -390,17 +465,16 @@ def normalize_join(join_text: str) -> str:
         s = f"LEFT JOIN {table_block} ON {cond}"
 
     # 1️⃣  Default JOIN type enforcement — use LEFT JOIN unless specified
-    if not re.search(r"(?i)\b(left|right|full)\s+join\b", s):
-        s = re.sub(r"(?i)\bjoin\b", "LEFT JOIN", s)
+    if not _OUTER_JOIN_TYPE.search(s):
+        s = _JOIN_WORD.sub("LEFT JOIN", s)
 
     # 2️⃣  Auto-detect lookup/reference tables and force LEFT JOIN
-    lookup_pattern = r"(?i)\b(_ref|_lkp|_xref|_map|_dim)\b"
-    if re.search(lookup_pattern, s):
-        s = re.sub(r"(?i)\b(inner|right|full)\s+join\b", "LEFT JOIN", s)
+    if _LOOKUP_TABLE.search(s):
+        s = _NON_LEFT_JOIN_TYPE.sub("LEFT JOIN", s)
 
     # 3️⃣  Fix malformed fragments like "LEFT JOIN ossbr_2_1 mas GLSXREF ref ON ..."
     #      → retain only last two tokens before ON (GLSXREF ref)
-    m = re.search(r"LEFT JOIN\s+([A-Za-z0-9_]+(?:\s+[A-Za-z0-9_]+)*)\s+ON\s+(.*)", s, re.I)
+    m = _LEFT_JOIN_ON.search(s)
     if m:
         table_block = m.group(1)
         cond = m.group(2)
@@ -409,15 +483,12 @@ def normalize_join(join_text: str) -> str:
             table_block = " ".join(parts[-2:])
         s = f"LEFT JOIN {table_block} ON {cond}"
 
-    s_final = squash(s)
-
-    if DEBUG_JOINS:
-        _debug_log("JOIN NORMALIZATION", s_final)
-
-    return s_final
+    return squash(s)
 
 # ---------- Lookup detection (for job JSON) ----------
 
+_LOOKUP_HINTS = ("lookup", "_lkp", "_xref", "_map", "_ref", "code_mapping")
+
 def detect_lookup(text_blocks: List[str]) -> bool:
     """
     Lightweight detector: return True if the combined text mentions lookup/reference tables.
@@ -425,6 +496,10 @@ def detect_lookup(text_blocks: List[str]) -> bool:
     """
     if not text_blocks:
         return False
-    joined = " ".join(str(t).lower() for t in text_blocks)
-    patterns = ["lookup", "_lkp", "_xref", "_map", "_ref", "code_mapping"]
-    return any(p in joined for p in patterns)
+    # Scan block by block and stop at the first hit. None of the patterns
+    # contains a space, so none could match across the blocks of a joined blob.
+    for t in text_blocks:
+        low = str(t).lower()
+        if any(p in low for p in _LOOKUP_HINTS):
+            return True
+    return False